@@ -1,4 +1,5 @@
 import gzip
+import io
 import json
 import pickle
 from collections import defaultdict
@@ -7,6 +8,16 @@ from zipfile import ZipFile
 
 from tqdm import tqdm
 
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 from capreolus import ConfigOption, Dependency, constants
 from capreolus.utils.common import download_file, remove_newline
 from capreolus.utils.loginit import get_logger
@@ -16,6 +27,15 @@ from . import Benchmark, validate
 
 logger = get_logger(__name__)
 PACKAGE_PATH = constants["PACKAGE_PATH"]
+GZ_READ_BUFFER_SIZE = 128 * 1024
+WRITE_BUFFER_SIZE = 1 << 20
+LINES_PER_WRITE = 10000
+
+
+def open_gz(fn):
+    """open a gzip file for binary reading, using ISA-L's igzip when available and a larger read buffer"""
+    f = igzip.open(fn, "rb") if igzip is not None else gzip.open(fn, "rb")
+    return io.BufferedReader(f, buffer_size=GZ_READ_BUFFER_SIZE)
 
 
 @Benchmark.register
@@ -52,8 +72,9 @@ class CodeSearchNetCorpus(Benchmark):
         self.topic_file = self.topic_dir / f"{lang}.txt"
         self.fold_file = self.fold_dir / f"{lang}.json"
 
-        for file in [var for var in vars(self) if var.endswith("file")]:
-            getattr(self, file).parent.mkdir(exist_ok=True, parents=True)
+        files = [self.qid_map_file, self.docid_map_file, self.qrel_file, self.topic_file, self.fold_file]
+        for parent in {f.parent for f in files}:
+            parent.mkdir(exist_ok=True, parents=True)
 
         self.download_if_missing()
 
@@ -63,7 +84,7 @@ class CodeSearchNetCorpus(Benchmark):
             if not self.qid_map_file.exists():
                 self.download_if_missing()
 
-            self._qid_map = json.load(open(self.qid_map_file, "r"))
+            self._qid_map = json_loads(self.qid_map_file.read_bytes())
         return self._qid_map
 
     @property
@@ -72,7 +93,7 @@ class CodeSearchNetCorpus(Benchmark):
             if not self.docid_map_file.exists():
                 self.download_if_missing()
 
-            self._docid_map = json.load(open(self.docid_map_file, "r"))
+            self._docid_map = json_loads(self.docid_map_file.read_bytes())
         return self._docid_map
 
     def download_if_missing(self):
@@ -92,7 +113,8 @@ class CodeSearchNetCorpus(Benchmark):
 
         # prepare docid-url mapping from dedup.pkl
         pkl_fn = tmp_dir / f"{lang}_dedupe_definitions_v2.pkl"
-        doc_objs = pickle.load(open(pkl_fn, "rb"))
+        with open(pkl_fn, "rb") as f:
+            doc_objs = pickle.load(f)
         self._docid_map = self._prep_docid_map(doc_objs)
         assert self._get_n_docid() == len(doc_objs)
 
@@ -100,48 +122,60 @@ class CodeSearchNetCorpus(Benchmark):
         qrels, self._qid_map = defaultdict(dict), {}
         qids = {s: [] for s in ["train", "valid", "test"]}
 
-        topic_file = open(self.topic_file, "w", encoding="utf-8")
-        qrel_file = open(self.qrel_file, "w", encoding="utf-8")
+        topic_file = open(self.topic_file, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE)
+        qrel_file = open(self.qrel_file, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE)
+        topic_lines, qrel_lines = [], []
 
         def gen_doc_from_gzdir(dir):
             """generate parsed dict-format doc from all jsonl.gz files under given directory"""
             for fn in sorted(dir.glob("*.jsonl.gz")):
-                f = gzip.open(fn, "rb")
-                for doc in f:
-                    yield json.loads(doc)
+                with open_gz(fn) as f:
+                    for doc in f:
+                        yield json_loads(doc)
 
+        # the docid map was just built, so look docids up in it directly rather than through the lazy property
+        docid_map = self._docid_map
         for set_name in qids:
             set_path = tmp_dir / lang / "final" / "jsonl" / set_name
             for doc in gen_doc_from_gzdir(set_path):
                 code = remove_newline(" ".join(doc["code_tokens"]))
                 docstring = remove_newline(" ".join(doc["docstring_tokens"]))
-                n_words_in_docstring = len(docstring.split())
-                if n_words_in_docstring >= 1024:
+                docstring_words = docstring.split()
+                if len(docstring_words) >= 1024:
                     logger.warning(
                         f"chunk query to first 1000 words otherwise TooManyClause would be triggered "
                         f"at lucene at search stage, "
                     )
-                    docstring = " ".join(docstring.split()[:1020])  # for TooManyClause
+                    docstring = " ".join(docstring_words[:1020])  # for TooManyClause
 
-                docid = self.get_docid(doc["url"], code)
+                docid = self._lookup_docid(docid_map, doc["url"], code)
                 qid = self._qid_map.get(docstring, str(len(self._qid_map)))
-                qrel_file.write(f"{qid} Q0 {docid} 1\n")
+                qrel_lines.append(f"{qid} Q0 {docid} 1\n")
 
                 if docstring not in self._qid_map:
                     self._qid_map[docstring] = qid
                     qids[set_name].append(qid)
-                    topic_file.write(topic_to_trectxt(qid, docstring))
+                    topic_lines.append(topic_to_trectxt(qid, docstring))
 
+                # write the accumulated lines in batches rather than issuing one write call per line
+                if len(qrel_lines) >= LINES_PER_WRITE:
+                    qrel_file.write("".join(qrel_lines))
+                    topic_file.write("".join(topic_lines))
+                    qrel_lines.clear()
+                    topic_lines.clear()
+
+        qrel_file.write("".join(qrel_lines))
+        topic_file.write("".join(topic_lines))
         topic_file.close()
         qrel_file.close()
 
         # write to qid_map.json, docid_map, fold.json
-        json.dump(self._qid_map, open(self.qid_map_file, "w"))
-        json.dump(self._docid_map, open(self.docid_map_file, "w"))
-        json.dump(
-            {"s1": {"train_qids": qids["train"], "predict": {"dev": qids["valid"], "test": qids["test"]}}},
-            open(self.fold_file, "w"),
-        )
+        with open(self.qid_map_file, "w") as f:
+            json.dump(self._qid_map, f)
+        with open(self.docid_map_file, "w") as f:
+            json.dump(self._docid_map, f)
+        with open(self.fold_file, "w") as f:
+            json.dump({"s1": {"train_qids": qids["train"], "predict": {"dev": qids["valid"], "test": qids["test"]}}}, f)
 
     def _prep_docid_map(self, doc_objs):
         """
@@ -174,7 +208,11 @@ class CodeSearchNetCorpus(Benchmark):
 
     def get_docid(self, url, code_tokens):
         """retrieve the doc id according to the doc dict"""
-        docids = self.docid_map[url]
+        return self._lookup_docid(self.docid_map, url, code_tokens)
+
+    @staticmethod
+    def _lookup_docid(docid_map, url, code_tokens):
+        docids = docid_map[url]
         return docids[0] if len(docids) == 1 else docids[code_tokens]
 
 
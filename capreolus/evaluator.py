@@ -1,4 +1,5 @@
 import os
+from collections import OrderedDict
 
 import numpy as np
 import pytrec_eval
@@ -27,6 +28,8 @@ DEFAULT_METRICS = [
     "recip_rank",
     MRR_10,
 ]
+MAX_CACHED_RELEVANCE_EVALUATORS = 8
+_relevance_evaluator_cache = OrderedDict()
 
 
 def judged(qrels, runs, n):
@@ -52,6 +55,27 @@ def mrr_10(qrels, runs):
     return list(compute_metrics_from_files(trec_qrels=qrels, trec_runs=runs).values())[0]
 
 
+def _get_relevance_evaluator(qrels, trec_metrics, relevance_level):
+    """
+    Returns a pytrec_eval.RelevanceEvaluator for qrels, reusing the one created by a previous call with the same qrels object.
+    Creating an evaluator parses every judgement in qrels, which dominates when many runs are evaluated against the same
+    qrels (e.g., each alpha tried by interpolated_eval). The cache holds a reference to qrels, so their id is not reused while
+    cached; qrels are assumed not to be modified after they are first evaluated.
+    """
+    key = (id(qrels), tuple(trec_metrics), relevance_level)
+    cached = _relevance_evaluator_cache.get(key)
+    if cached is not None and cached[0] is qrels:
+        _relevance_evaluator_cache.move_to_end(key)
+        return cached[1]
+
+    relevance_evaluator = pytrec_eval.RelevanceEvaluator(qrels, trec_metrics, relevance_level=relevance_level)
+    _relevance_evaluator_cache[key] = (qrels, relevance_evaluator)
+    if len(_relevance_evaluator_cache) > MAX_CACHED_RELEVANCE_EVALUATORS:
+        _relevance_evaluator_cache.popitem(last=False)
+
+    return relevance_evaluator
+
+
 def _eval_runs(runs, qrels, metrics, relevance_level):
     overlap_qids = set(qrels) & set(runs)
     if len(overlap_qids) == 0:
@@ -72,7 +96,7 @@ def _eval_runs(runs, qrels, metrics, relevance_level):
         metrics.remove(f"judged_{n}")
     trec_metrics = [m for m in metrics if m not in [MRR_10]]
 
-    evaluator = pytrec_eval.RelevanceEvaluator(qrels, trec_metrics, relevance_level=int(relevance_level))
+    evaluator = _get_relevance_evaluator(qrels, trec_metrics, int(relevance_level))
     scores = [[metrics_dict.get(m, -1) for m in trec_metrics] for metrics_dict in evaluator.evaluate(runs).values()]
     scores = np.array(scores).mean(axis=0).tolist()
     scores = dict(zip(trec_metrics, scores))
@@ -165,7 +189,7 @@ def search_best_run(runfile_dirs, benchmark, primary_metric, metrics=None, folds
         test_qids = folds[s]["predict"]["test"]
         # any empty (no results) queries need to be added so they contribute zeros to the average
         test_runs.update({qid: {} for qid in test_qids})
-        test_runs.update({qid: v for qid, v in Searcher.load_trec_run(score_dict["path"]).items() if qid in test_qids})
+        test_runs.update(Searcher.load_trec_run(score_dict["path"], qids=test_qids))
 
     scores = eval_runs(test_runs, benchmark.qrels, metrics, benchmark.relevance_level)
     return {"score": scores, "path": {s: v["path"] for s, v in best_scores.items()}}
@@ -175,26 +199,28 @@ def interpolate_runs(run1, run2, qids, alpha):
     out = {}
     for qid in qids:
         out[qid] = {}
+        # qids without any results may be missing from either run
+        docscores1, docscores2 = run1.get(qid, {}), run2.get(qid, {})
 
-        if len(run1[qid]) == 0:
+        if len(docscores1) == 0:
             min1, max1 = 0, 1
         else:
-            min1, max1 = min(run1[qid].values()), max(run1[qid].values())
+            min1, max1 = min(docscores1.values()), max(docscores1.values())
 
             if min1 == max1:
                 min1 = 0.01 * max1 - 0.01
 
-        if len(run2[qid]) == 0:
+        if len(docscores2) == 0:
             min2, max2 = 0, 1
         else:
-            min2, max2 = min(run2[qid].values()), max(run2[qid].values())
+            min2, max2 = min(docscores2.values()), max(docscores2.values())
 
             if min2 == max2:
                 min2 = 0.01 * max2 - 0.01
 
-        for docid in run1[qid].keys() | run2[qid]:
-            score1 = run1[qid].get(docid, min1)
-            score2 = run2[qid].get(docid, min2)
+        for docid in docscores1.keys() | docscores2:
+            score1 = docscores1.get(docid, min1)
+            score2 = docscores2.get(docid, min2)
 
             score1 = (score1 - min1) / (max1 - min1)
             score2 = (score2 - min2) / (max2 - min2)
@@ -217,10 +243,10 @@ def interpolated_eval(run1, run2, benchmark, primary_metric, metrics=None):
 
         for alpha in np.arange(0, 1.001, 0.05):
             interpolated_run = interpolate_runs(dev1, dev2, dev_qids, alpha)
-            metrics = eval_runs(interpolated_run, benchmark.qrels, metrics, benchmark.relevance_level)
+            dev_scores = eval_runs(interpolated_run, benchmark.qrels, metrics, benchmark.relevance_level)
 
-            if best_metric is None or metrics[primary_metric] > best_metric:
-                best_metric = metrics[primary_metric]
+            if best_metric is None or dev_scores[primary_metric] > best_metric:
+                best_metric = dev_scores[primary_metric]
                 alphas[s] = alpha
 
         test_qids = set(v["predict"]["test"])
@@ -49,9 +49,8 @@ class Extractor(ModuleBase):
         """
         Returns the path to the cache file used to store the extractor state, regardless of whether it exists or not
         """
-        sorted_qids = sorted(qids)
-        sorted_docids = sorted(docids)
-        return self.get_cache_path() / hashlib.md5(str(sorted_qids + sorted_docids).encode("utf-8")).hexdigest()
+        key = "\n".join(sorted(qids)) + "\t" + "\n".join(sorted(docids))
+        return self.get_cache_path() / hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
 
     def is_state_cached(self, qids, docids):
         """
@@ -1,6 +1,8 @@
 import os
 import pickle
-from collections import Counter, defaultdict
+from collections import defaultdict
+from functools import lru_cache
+from itertools import chain, repeat
 
 import numpy as np
 
@@ -12,6 +14,11 @@ from . import Extractor
 logger = get_logger(__name__)  # pylint: disable=invalid-name
 
 
+def get_trigrams_for_tok(tok):
+    tok = "#%s#" % tok
+    return tuple(tok[i : i + 3] for i in range(len(tok) - 2))
+
+
 @Extractor.register
 class BagOfWords(Extractor):
     """Bag of Words (or bag of trigrams when `datamode=trigram`) extractor. Used with the DSSM reranker."""
@@ -35,7 +42,8 @@ class BagOfWords(Extractor):
 
     def _tok2vec(self, toks):
         # return [self.embeddings[self.stoi[tok]] for tok in toks]
-        return [self.stoi.get(tok, 0) for tok in toks]
+        # map(stoi.get, toks, repeat(0)) performs the stoi.get(tok, 0) lookups without a Python-level loop
+        return np.fromiter(map(self.stoi.get, toks, repeat(0, len(toks))), dtype=np.int64, count=len(toks))
 
     def load_state(self, qids, docids):
         with open(self.get_state_cache_file_path(qids, docids), "rb") as f:
@@ -58,22 +66,40 @@ class BagOfWords(Extractor):
             }
             pickle.dump(state_dict, f, protocol=-1)
 
-    def get_trigrams_for_toks(self, toks_list):
-        return [("#%s#" % tok)[i : i + 3] for tok in toks_list for i in range(len(tok))]
+    def get_trigrams_for_toks(self, toks_list, get_trigrams=get_trigrams_for_tok):
+        # get_trigrams may be a memoized get_trigrams_for_tok, so that repeated tokens only cost a cache lookup
+        return list(chain.from_iterable(map(get_trigrams, toks_list)))
+
+    def _tokenize_queries(self, qids, topics, tokenize):
+        """
+        Returns a {qid: toks} dict, tokenizing each distinct topic text only once.
+        Tokens are returned as tuples since the same object may be shared by several qids.
+        """
+        memoized_tokenize = lru_cache(maxsize=None)(lambda text: tuple(tokenize(text)))
+        return {qid: memoized_tokenize(topics[qid]) for qid in qids}
+
+    def _tokenize_docs(self, docids, tokenize):
+        """Returns a {docid: toks} dict; each doc is fetched and tokenized in turn, so only its tokens are kept in memory"""
+        return {docid: tokenize(self.index.get_doc(docid)) for docid in docids}
 
     def _build_vocab_unigram(self, qids, docids, topics):
         tokenize = self.tokenizer.tokenize
-        self.qid2toks = {qid: tokenize(topics[qid]) for qid in qids}
-        self.docid2toks = {docid: tokenize(self.index.get_doc(docid)) for docid in docids}
+        self.qid2toks = self._tokenize_queries(qids, topics, tokenize)
+        self.docid2toks = self._tokenize_docs(docids, tokenize)
         self._extend_stoi(self.qid2toks.values(), calc_idf=True)
         self._extend_stoi(self.docid2toks.values())
         self.itos = {i: s for s, i in self.stoi.items()}
         logger.info(f"vocabulary constructed, with {len(self.itos)} terms in total")
 
     def _build_vocab_trigram(self, qids, docids, topics):
-        tokenize = self.tokenizer.tokenize
-        self.qid2toks = {qid: self.get_trigrams_for_toks(tokenize(topics[qid])) for qid in qids}
-        self.docid2toks = {docid: self.get_trigrams_for_toks(tokenize(self.index.get_doc(docid))) for docid in docids}
+        # the trigram memo only lives for this build rather than for the rest of the process
+        get_trigrams = lru_cache(maxsize=None)(get_trigrams_for_tok)
+
+        def tokenize(text):
+            return self.get_trigrams_for_toks(self.tokenizer.tokenize(text), get_trigrams)
+
+        self.qid2toks = self._tokenize_queries(qids, topics, tokenize)
+        self.docid2toks = self._tokenize_docs(docids, tokenize)
         self._extend_stoi(self.qid2toks.values(), calc_idf=True)
         self._extend_stoi(self.docid2toks.values())
         self.itos = {i: s for s, i in self.stoi.items()}
@@ -94,6 +120,15 @@ class BagOfWords(Extractor):
                 self.cache_state(qids, docids)
 
         self.embeddings = self.stoi
+        self._build_idf_array()
+
+    def _build_idf_array(self):
+        """store the idf of each vocab term in a float32 array indexed by its stoi id"""
+        idf_toks = [tok for tok in self.idf if tok in self.stoi]
+        self.idf_array = np.zeros(len(self.stoi), dtype=np.float32)
+        self.idf_array[self._tok2vec(idf_toks)] = np.fromiter(
+            (self.idf[tok] for tok in idf_toks), dtype=np.float32, count=len(idf_toks)
+        )
 
     def exist(self):
         return hasattr(self, "qid2toks") and hasattr(self, "docid2toks") and len(self.stoi) > 1
@@ -108,6 +143,7 @@ class BagOfWords(Extractor):
         self.docid2toks = defaultdict(list)
         self.idf = defaultdict(lambda: 0)
         self.embeddings = None
+        self._docvec_cache_nvocab = None
         # self.cache = self.load_cache()    # TODO
 
         self._build_vocab(qids, docids, topics)
@@ -122,15 +158,17 @@ class BagOfWords(Extractor):
 
         transformed_query = self.transform_txt(query_toks, self.config["maxqlen"])
 
+        if len(getattr(self, "idf_array", ())) != len(self.stoi):
+            self._build_idf_array()
+        query_ids = self._tok2vec(query_toks)
         query_idf_vector = np.zeros(len(self.stoi), dtype=np.float32)
-        for tok in query_toks:
-            query_idf_vector[self.stoi.get(tok, 0)] = self.idf[tok]
+        query_idf_vector[query_ids] = self.idf_array[query_ids]
 
         transformed = {
             "qid": q_id,
             "posdocid": posdoc_id,
             "query": transformed_query,
-            "posdoc": self.transform_txt(posdoc_toks, self.config["maxdoclen"]),
+            "posdoc": self._transform_doc(posdoc_id, posdoc_toks),
             "query_idf": query_idf_vector,
         }
         if negdoc_id is not None:
@@ -139,25 +177,37 @@ class BagOfWords(Extractor):
                 logger.debug("missing docid %s", negdoc_id)
                 return None
             transformed["negdocid"] = negdoc_id
-            transformed["negdoc"] = self.transform_txt(negdoc_toks, self.config["maxdoclen"])
+            transformed["negdoc"] = self._transform_doc(negdoc_id, negdoc_toks)
 
         return transformed
 
-    def transform_txt(self, term_list, maxlen):
-        term_vec = self._tok2vec(term_list)
+    def _transform_doc(self, docid, doc_toks):
+        """transform_txt for documents, memoized by docid since the same doc is sampled many times during training"""
         nvocab = len(self.stoi)
-        bog_txt = np.zeros(nvocab, dtype=np.float32)
+        if getattr(self, "_docvec_cache_nvocab", None) != nvocab:
+            # cached vectors are only valid for the vocabulary they were built with
+            self._docvec_cache = {}
+            self._docvec_cache_nvocab = nvocab
+
+        # most entries of a bag of words are zero, so only the (vocab id, count) pairs of the nonzero ones are kept
+        sparse_docvec = self._docvec_cache.get(docid)
+        if sparse_docvec is None:
+            docvec = self.transform_txt(doc_toks, self.config["maxdoclen"])
+            nonzero_ids = np.flatnonzero(docvec)
+            self._docvec_cache[docid] = (nonzero_ids, docvec[nonzero_ids])
+            return docvec
+
+        nonzero_ids, counts = sparse_docvec
+        docvec = np.zeros(nvocab, dtype=np.float32)
+        docvec[nonzero_ids] = counts
+        return docvec
 
+    def transform_txt(self, term_list, maxlen):
         if self.config["datamode"] == "unigram":
-            for term in term_vec:
-                bog_txt[term] += 1
+            term_vec = self._tok2vec(term_list)
         elif self.config["datamode"] == "trigram":
-            trigrams = self.get_trigrams_for_toks(term_list)
-            toks = [self.stoi.get(trigram, 0) for trigram in trigrams]
-            tok_counts = Counter(toks)
-            for tok, count in tok_counts.items():
-                bog_txt[tok] = count
+            term_vec = self._tok2vec(self.get_trigrams_for_toks(term_list))
         else:
             raise Exception("Unknown datamode")
 
-        return bog_txt
+        return np.bincount(term_vec, minlength=len(self.stoi)).astype(np.float32, copy=False)
@@ -42,6 +42,7 @@ class BertPassage(Extractor):
         ConfigOption("stride", 100, "Stride"),
         ConfigOption("sentences", False, "Use a sentence tokenizer to form passages"),
         ConfigOption("numpassages", 16, "Number of passages per document"),
+        ConfigOption("maxdocchars", 0, "Truncate documents to this many characters before tokenizing them (0 to disable)"),
         ConfigOption(
             "prob",
             0.1,
@@ -225,6 +226,9 @@ class BertPassage(Extractor):
 
     def _get_passages(self, docid):
         doc = self.index.get_doc(docid)
+        # only the first numpassages passages are kept, so tokenizing the remainder of a long document is wasted work
+        if self.config["maxdocchars"] > 0:
+            doc = doc[: self.config["maxdocchars"]]
         if not self.config["sentences"]:
             return self._get_sliding_window_passages(doc)
         else:
@@ -36,6 +36,7 @@ class PooledBertPassage(BertPassage):
         ConfigOption("stride", 100, "Stride"),
         ConfigOption("sentences", False, "Use a sentence tokenizer to form passages"),
         ConfigOption("numpassages", 16, "Number of passages per document"),
+        ConfigOption("maxdocchars", 0, "Truncate documents to this many characters before tokenizing them (0 to disable)"),
         # TODO remove prob here. unused.
         ConfigOption(
             "prob",
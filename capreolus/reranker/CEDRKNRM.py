@@ -85,9 +85,10 @@ class CEDRKNRM_Class(nn.Module):
         # based on cos_simmat from https://github.com/Georgetown-IR-Lab/OpenNIR/blob/master/onir/modules/interaction_matrix.py
         # which is copyright (c) 2019 Georgetown Information Retrieval Lab, MIT license
         BAT, A, B = a.shape[0], a.shape[1], b.shape[1]
-        a_denom = a.norm(p=2, dim=2).reshape(BAT, A, 1) + 1e-9  # avoid 0div
-        b_denom = b.norm(p=2, dim=2).reshape(BAT, 1, B) + 1e-9  # avoid 0div
-        result = a.bmm(b.permute(0, 2, 1)) / (a_denom * b_denom)
+        # normalize the (smaller) reps rather than dividing the (BAT, A, B) similarity matrix
+        a = a / (a.norm(p=2, dim=2, keepdim=True) + 1e-9)  # avoid 0div
+        b = b / (b.norm(p=2, dim=2, keepdim=True) + 1e-9)  # avoid 0div
+        result = a.bmm(b.permute(0, 2, 1))
         result = result * amask.reshape(BAT, A, 1)
         result = result * bmask.reshape(BAT, 1, B)
         return result
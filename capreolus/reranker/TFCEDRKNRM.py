@@ -185,8 +185,11 @@ class TFCEDRKNRM_Class(tf.keras.layers.Layer):
     def score_pair(self, x, **kwargs):
         posdoc_bert_input, posdoc_mask, posdoc_seg, negdoc_bert_input, negdoc_mask, negdoc_seg = x
 
-        pos_score = self.call((posdoc_bert_input, posdoc_mask, posdoc_seg), **kwargs)
-        neg_score = self.call((negdoc_bert_input, negdoc_mask, negdoc_seg), **kwargs)
+        # score the positive and negative docs with a single BERT forward pass over the concatenated batch
+        doc_input = tf.concat([posdoc_bert_input, negdoc_bert_input], axis=0)
+        doc_mask = tf.concat([posdoc_mask, negdoc_mask], axis=0)
+        doc_seg = tf.concat([posdoc_seg, negdoc_seg], axis=0)
+        pos_score, neg_score = tf.split(self.call((doc_input, doc_mask, doc_seg), **kwargs), 2, axis=0)
 
         return pos_score, neg_score
 
@@ -63,19 +63,20 @@ def pair_hinge_loss(pos_neg_scores, *args, **kwargs):
 
 
 def new_similarity_matrix_tf(query_embed, doc_embed, query_tok, doc_tok, padding):
-    batch, qlen, dims = query_embed.shape
+    batch, qlen = query_embed.shape[:2]
     doclen = doc_embed.shape[1]
 
-    query_embed = tf.reshape(tf.nn.l2_normalize(query_embed, axis=-1), [batch, qlen, 1, dims])
-    query_padding = tf.reshape(tf.cast(query_tok != padding, query_embed.dtype), [batch, qlen, 1, 1])
+    query_embed = tf.nn.l2_normalize(query_embed, axis=-1)
+    query_padding = tf.reshape(tf.cast(query_tok != padding, query_embed.dtype), [batch, qlen, 1])
     query_embed = query_embed * query_padding
 
-    doc_embed = tf.reshape(tf.nn.l2_normalize(doc_embed, axis=-1), [batch, 1, doclen, dims])
-    doc_padding = tf.reshape(tf.cast(doc_tok != padding, doc_embed.dtype), [batch, 1, doclen, 1])
+    doc_embed = tf.nn.l2_normalize(doc_embed, axis=-1)
+    doc_padding = tf.reshape(tf.cast(doc_tok != padding, doc_embed.dtype), [batch, doclen, 1])
     doc_embed = doc_embed * doc_padding
 
-    simmat = tf.reduce_sum(query_embed * doc_embed, axis=-1, keepdims=True)
-    return simmat
+    # the embeddings are normalized, so a matmul gives the cosine similarity without a (batch, qlen, doclen, dims) product
+    simmat = tf.matmul(query_embed, doc_embed, transpose_b=True)
+    return tf.expand_dims(simmat, axis=-1)
 
 
 def similarity_matrix_tf(query_embed, doc_embed, query_tok, doc_tok, padding):
@@ -206,7 +207,13 @@ class RbfKernelBank(torch.nn.Module):
         return len(self.kernels)
 
     def forward(self, data):
-        return torch.stack([k(data) for k in self.kernels], dim=self.dim)
+        # evaluate all kernels in one broadcasted op instead of stacking K separate kernel outputs
+        shape = [1] * (data.dim() + 1)
+        shape[self.dim] = -1
+        mus = torch.stack([k.mu for k in self.kernels]).view(shape)
+        sigmas = torch.stack([k.sigma for k in self.kernels]).view(shape)
+        adj = data.unsqueeze(self.dim) - mus
+        return torch.exp(-0.5 * adj * adj / sigmas / sigmas)
 
 
 class RbfKernelBankTF(Layer):
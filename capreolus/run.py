@@ -63,6 +63,9 @@ Usage:
       rerank.train            run rank.search and train a model to rerank the results
       rerank.evaluate         evaluate the result of rerank.train
       rerank.traineval        run rerank.train followed by rerank.evaluate
+      rerank.traineval_all_folds
+                              run rerank.train on every fold (concurrently when multiple GPUs are available)
+                              followed by rerank.evaluate
 
       rererank.train          run rerank.train and train a (second) model to rerank the results
       rererank.evaluate       evaluate the result of rererank.train
@@ -180,19 +180,38 @@ class PredSampler(Sampler, torch.utils.data.IterableDataset):
 
         return "dev_{0}".format(key)
 
+    def prepare_from_cache(self, qid_to_docids, qrels, extractor, feature_cache, relevance_level=1, **kwargs):
+        """
+        Like prepare, but features are read from and added to feature_cache, a dict of the form {(qid, docid): features}.
+        This avoids calling extractor.id2vec again each time the samples are generated (e.g., once per validation).
+        Since features include the label, feature_cache should only be shared by samplers using the same qrels and relevance_level.
+        """
+        self.feature_cache = feature_cache
+        self.prepare(qid_to_docids, qrels, extractor, relevance_level=relevance_level, **kwargs)
+
     def generate_samples(self):
+        feature_cache = getattr(self, "feature_cache", None)
         for qid, docids in self.qid_to_docids.items():
+            reldocs = self.qid_to_reldocs[qid]
             for docid in docids:
+                if feature_cache is not None and (qid, docid) in feature_cache:
+                    yield feature_cache[(qid, docid)]
+                    continue
+
                 try:
-                    if docid in self.qid_to_reldocs[qid]:
-                        yield self.extractor.id2vec(qid, docid, label=[0, 1])
+                    if docid in reldocs:
+                        features = self.extractor.id2vec(qid, docid, label=[0, 1])
                     else:
-                        yield self.extractor.id2vec(qid, docid, label=[1, 0])
+                        features = self.extractor.id2vec(qid, docid, label=[1, 0])
                 except MissingDocError:
                     # when predictiong we raise an exception on missing docs, as this may invalidate results
                     logger.error("got none features for prediction: qid=%s posid=%s", qid, docid)
                     raise
 
+                if feature_cache is not None:
+                    feature_cache[(qid, docid)] = features
+                yield features
+
     def clean(self):
         total_samples = 0  # keep tracks of the total possible number of unique training triples for this dataset
         for qid in list(self.qid_to_docids.keys()):
@@ -61,3 +61,35 @@ def test_pred_sampler(monkeypatch, tmpdir):
         assert np.array_equal(batch["query"][1], np.array([1, 2, 3, 4]))
         assert np.array_equal(batch["posdoc"][0], np.array([1, 1, 1, 1]))
         assert np.array_equal(batch["posdoc"][1], np.array([1, 1, 1, 1]))
+
+
+def test_pred_sampler_feature_cache(monkeypatch, tmpdir):
+    benchmark = DummyBenchmark()
+    extractor = EmbedText(
+        {"tokenizer": {"keepstops": True}}, provide={"collection": benchmark.collection, "benchmark": benchmark}
+    )
+    search_run = {"301": {"LA010189-0001": 50, "LA010189-0002": 100}}
+
+    calls = []
+
+    def mock_id2vec(self, qid, posdocid, negdocid=None, label=None):
+        calls.append((qid, posdocid))
+        return {"query": np.array([1, 2, 3, 4]), "posdoc": np.array([1, 1, 1, 1]), "label": np.array(label)}
+
+    monkeypatch.setattr(EmbedText, "id2vec", mock_id2vec)
+    feature_cache = {}
+    pred_dataset = PredSampler()
+    pred_dataset.prepare_from_cache(search_run, benchmark.qrels, extractor, feature_cache)
+
+    first = list(pred_dataset)
+    assert len(calls) == 2
+    assert set(feature_cache) == {("301", "LA010189-0001"), ("301", "LA010189-0002")}
+
+    second = list(pred_dataset)
+    assert len(calls) == 2
+    assert all(a is b for a, b in zip(first, second))
+
+    other_dataset = PredSampler()
+    other_dataset.prepare_from_cache({"301": {"LA010189-0001": 50}}, benchmark.qrels, extractor, feature_cache)
+    assert list(other_dataset)[0] is first[0]
+    assert len(calls) == 2
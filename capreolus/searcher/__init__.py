@@ -27,7 +27,11 @@ class Searcher(ModuleBase):
     module_type = "searcher"
 
     @staticmethod
-    def load_trec_run(fn):
+    def load_trec_run(fn, qids=None):
+        """Loads the run in fn. If qids is given, only those qids are retained; other lines are skipped while reading."""
+        if qids is not None:
+            qids = frozenset(qids)
+
         # Docids in the run file appear according to decreasing score, hence it makes sense to preserve this order
         run = OrderedDefaultDict()
 
@@ -39,10 +43,12 @@ class Searcher(ModuleBase):
                         qid, _, docid, rank, score, desc = line.split()
                     except ValueError as e:
                         logger.error(
-                            f"Encountered malformated line when reading {fn} [Line #{i}], possibly because the writing to runfile was interruptded."
+                            f"Encountered malformed line when reading {fn} [Line #{i}], possibly because the writing to runfile was interrupted."
                         )
                         raise e
-                    run[qid][docid] = float(score)
+
+                    if qids is None or qid in qids:
+                        run[qid][docid] = float(score)
         return run
 
     @staticmethod
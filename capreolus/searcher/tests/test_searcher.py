@@ -67,3 +67,18 @@ def test_searcher_bm25_grid(tmpdir_as_cache, tmpdir, dummy_index):
         for b in bs:
             assert os.path.exists(os.path.join(output_dir, "searcher_bm25(k1={0},b={1})_default".format(k1, b)))
     assert os.path.exists(os.path.join(output_dir, "done"))
+
+
+def test_load_trec_run_qids(tmpdir):
+    fn = os.path.join(tmpdir, "run.txt")
+    with open(fn, "wt") as f:
+        for qid in ["301", "302", "303"]:
+            for rank, docid in enumerate(["d1", "d2", "d3"], start=1):
+                print(f"{qid} Q0 {docid} {rank} {-rank} capreolus", file=f)
+
+    run = Searcher.load_trec_run(fn)
+    assert list(run) == ["301", "302", "303"]
+    assert list(run["302"].items()) == [("d1", -1.0), ("d2", -2.0), ("d3", -3.0)]
+
+    assert Searcher.load_trec_run(fn, qids=["301", "303"]) == {qid: run[qid] for qid in ["301", "303"]}
+    assert Searcher.load_trec_run(fn, qids=set()) == {}
@@ -1,14 +1,72 @@
+import functools
+import itertools
+import multiprocessing
 import os
-from collections import defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
-from capreolus import ConfigOption, Dependency, evaluator
+import torch
+
+from capreolus import ConfigOption, Dependency, constants, evaluator
 from capreolus.sampler import PredSampler
 from capreolus.searcher import Searcher
 from capreolus.task import Task
 from capreolus.utils.loginit import get_logger
 
 logger = get_logger(__name__)
+MAX_THREADS = constants["MAX_THREADS"]
+
+
+def load_trec_run_cached(path, cache):
+    """Searcher.load_trec_run memoized in cache, a dict owned by the caller (e.g., a task instance).
+    A cached run is reused only while the file's inode, mtime and size are unchanged. The returned run is shared
+    by every caller, so callers that modify it must copy it first."""
+    path = str(path)
+    stat = os.stat(path)
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if path not in cache or cache[path][0] != key:
+        cache[path] = (key, Searcher.load_trec_run(path))
+
+    return cache[path][1]
+
+
+def load_trec_runs_concurrently(paths, cache):
+    """Loads several TREC runs with a thread pool, returning them in the same order as paths"""
+    if not paths:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(MAX_THREADS, len(paths))) as executor:
+        return list(executor.map(functools.partial(load_trec_run_cached, cache=cache), paths))
+
+
+def fold_path_formatter(path, fold):
+    """Returns a function mapping another fold's name to its equivalent of path, which belongs to fold.
+    The path is split around its fold token once, so each call is a single join rather than a scan and replace."""
+    parts = Path(path).as_posix().split("fold-" + fold)
+    return lambda other_fold: Path(("fold-" + other_fold).join(parts))
+
+
+def find_existing_fold_paths(path, fold, folds):
+    """Returns {other_fold: path} for each of folds whose equivalent of path (which belongs to fold) exists"""
+    path_for_fold = fold_path_formatter(path, fold)
+    candidates = {other_fold: path_for_fold(other_fold) for other_fold in folds}
+    return {other_fold: p for other_fold, p in candidates.items() if os.path.exists(p)}
+
+
+def _config_to_dict(config):
+    return {k: _config_to_dict(v) if isinstance(v, Mapping) else v for k, v in config.items()}
+
+
+def _pin_worker_to_gpu(gpu_queue):
+    # runs before the worker touches CUDA, so each worker process only sees the GPU it took from the queue
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_queue.get())
+
+
+def _train_fold(module_name, config, fold):
+    task = Task.create(module_name, dict(config, fold=fold))
+    task.train()
+    return fold
 
 
 @Task.register
@@ -20,7 +78,13 @@ class RerankTask(Task):
         ConfigOption("metrics", "default", "metrics reported for evaluation", value_type="strlist"),
         ConfigOption("threshold", 100, "Number of docids per query to evaluate during prediction"),
         ConfigOption("testthreshold", 1000, "Number of docids per query to evaluate on test data"),
+        ConfigOption(
+            "cachedevfeatures",
+            False,
+            "keep the dev set's features in memory between validations (no effect with the pytorch trainer's multithread option)",
+        ),
     ]
+    config_keys_not_in_path = ["cachedevfeatures"]  # affects only memory use and speed, not results
     dependencies = [
         Dependency(
             key="benchmark", module="benchmark", name="robust04.yang19", provide_this=True, provide_children=["collection"]
@@ -30,20 +94,77 @@ class RerankTask(Task):
         Dependency(key="sampler", module="sampler", name="triplet"),
     ]
 
-    commands = ["train", "evaluate", "traineval"] + Task.help_commands
+    commands = ["train", "evaluate", "traineval", "traineval_all_folds"] + Task.help_commands
     default_command = "describe"
 
     def traineval(self):
         self.train()
         self.evaluate()
 
+    def traineval_all_folds(self):
+        """Train on every fold of the benchmark and then evaluate, which includes the cross-validated metrics.
+        With multiple GPUs, the folds are trained concurrently by worker processes that are each pinned to one GPU."""
+        self.rank.search()
+        config = _config_to_dict(self.config)
+        folds = list(self.benchmark.folds)
+        n_gpus = torch.cuda.device_count()
+        if n_gpus <= 1:
+            for fold in folds:
+                _train_fold(type(self).module_name, config, fold)
+        else:
+            # cache the extractor state for each distinct best run up front, so the workers only load it rather than
+            # racing to write it. an extractor builds its state once, so each run is preprocessed by a fresh task's extractor.
+            # extractors that do not cache their state would redo this in each worker anyway.
+            if self.reranker.extractor.config.get("usecache"):
+                rank_results = self._get_rank_results()
+                fold_for_run_path = {}
+                for fold in folds:
+                    fold_for_run_path.setdefault(rank_results["path"][fold], fold)
+
+                topics = self.benchmark.topics[self.benchmark.query_type]
+                for best_search_run_path, fold in fold_for_run_path.items():
+                    best_search_run = load_trec_run_cached(best_search_run_path, self.run_cache)
+                    extractor = Task.create(type(self).module_name, dict(config, fold=fold)).reranker.extractor
+                    extractor.preprocess(
+                        qids=best_search_run.keys(), docids=set().union(*best_search_run.values()), topics=topics
+                    )
+
+            # spawn rather than fork, since the parent may already hold CUDA and JVM state
+            context = multiprocessing.get_context("spawn")
+            gpu_queue = context.Queue()
+            visible_gpus = os.environ.get("CUDA_VISIBLE_DEVICES")
+            for gpu in visible_gpus.split(",")[:n_gpus] if visible_gpus else range(n_gpus):
+                gpu_queue.put(gpu)
+
+            with ProcessPoolExecutor(
+                max_workers=n_gpus, mp_context=context, initializer=_pin_worker_to_gpu, initargs=(gpu_queue,)
+            ) as executor:
+                module_names = [type(self).module_name] * len(folds)
+                for fold in executor.map(_train_fold, module_names, [config] * len(folds), folds):
+                    logger.info("rerank: finished training fold=%s", fold)
+
+        return self.evaluate()
+
+    def _get_rank_results(self):
+        """Returns the (memoized) results of self.rank.evaluate(), which parses every first-stage run"""
+        if getattr(self, "_rank_results", None) is None:
+            self._rank_results = self.rank.evaluate()
+        return self._rank_results
+
+    @property
+    def run_cache(self):
+        """Runs loaded by this task, keyed by path; see load_trec_run_cached"""
+        if not hasattr(self, "_run_cache"):
+            self._run_cache = {}
+        return self._run_cache
+
     def train(self):
         fold = self.config["fold"]
 
         self.rank.search()
-        rank_results = self.rank.evaluate()
+        rank_results = self._get_rank_results()
         best_search_run_path = rank_results["path"][fold]
-        best_search_run = Searcher.load_trec_run(best_search_run_path)
+        best_search_run = load_trec_run_cached(best_search_run_path, self.run_cache)
 
         return self.rerank_run(best_search_run, self.get_results_path())
 
@@ -51,39 +172,47 @@ class RerankTask(Task):
         if not isinstance(train_output_path, Path):
             train_output_path = Path(train_output_path)
 
+        # the trainers select weights by looking optimize up in the DEFAULT_METRICS computed at each validation,
+        # so check it here rather than failing with a KeyError after the first training iteration
+        optimize = self.config["optimize"]
+        if optimize not in evaluator.DEFAULT_METRICS:
+            logger.error("optimize=%s is not one of the metrics computed on the dev set: %s", optimize, evaluator.DEFAULT_METRICS)
+            raise ValueError(f"unsupported optimize metric: {optimize}")
+
         fold = self.config["fold"]
+        threshold, testthreshold = self.config["threshold"], self.config["testthreshold"]
+        fold_info = self.benchmark.folds[fold]
+        topics = self.benchmark.topics[self.benchmark.query_type]
+        qrels, relevance_level = self.benchmark.qrels, self.benchmark.relevance_level
+        extractor = self.reranker.extractor
+
         dev_output_path = train_output_path / "pred" / "dev"
         logger.debug("results path: %s", train_output_path)
 
-        docids = set(docid for querydocs in best_search_run.values() for docid in querydocs)
-        self.reranker.extractor.preprocess(
-            qids=best_search_run.keys(), docids=docids, topics=self.benchmark.topics[self.benchmark.query_type]
-        )
+        docids = set().union(*best_search_run.values())
+        extractor.preprocess(qids=best_search_run.keys(), docids=docids, topics=topics)
         self.reranker.build_model()
         self.reranker.searcher_scores = best_search_run
 
-        train_run = {qid: docs for qid, docs in best_search_run.items() if qid in self.benchmark.folds[fold]["train_qids"]}
+        train_qids = frozenset(fold_info["train_qids"])
+        train_run = {qid: docs for qid, docs in best_search_run.items() if qid in train_qids}
         # For each qid, select the top 100 (defined by config["threshold") docs to be used in validation
-        dev_run = defaultdict(dict)
-        # This is possible because best_search_run is an OrderedDict
-        for qid, docs in best_search_run.items():
-            if qid in self.benchmark.folds[fold]["predict"]["dev"]:
-                for idx, (docid, score) in enumerate(docs.items()):
-                    if idx >= self.config["threshold"]:
-                        break
-                    dev_run[qid][docid] = score
+        dev_run = self._top_k_run(best_search_run, fold_info["predict"]["dev"], threshold)
 
         # Depending on the sampler chosen, the dataset may generate triplets or pairs
         train_dataset = self.sampler
-        train_dataset.prepare(
-            train_run, self.benchmark.qrels, self.reranker.extractor, relevance_level=self.benchmark.relevance_level
-        )
+        train_dataset.prepare(train_run, qrels, extractor, relevance_level=relevance_level)
         dev_dataset = PredSampler()
-        dev_dataset.prepare(
-            dev_run, self.benchmark.qrels, self.reranker.extractor, relevance_level=self.benchmark.relevance_level
-        )
-
-        dev_qrels = {qid: self.benchmark.qrels[qid] for qid in self.benchmark.non_nn_dev[fold] if qid in self.benchmark.qrels}
+        if self.config["cachedevfeatures"]:
+            # the dev set is predicted at every validation, so keep its features rather than recomputing them each time.
+            # the cache is filled in the process iterating over the sampler, so a DataLoader worker's copy would be discarded
+            if self.reranker.trainer.config.get("multithread"):
+                logger.warning("cachedevfeatures has no effect when the trainer's multithread option is set")
+            dev_dataset.prepare_from_cache(dev_run, qrels, extractor, feature_cache={}, relevance_level=relevance_level)
+        else:
+            dev_dataset.prepare(dev_run, qrels, extractor, relevance_level=relevance_level)
+
+        dev_qrels = {qid: qrels[qid] for qid in self.benchmark.non_nn_dev[fold] if qid in qrels}
         dev_preds = self.reranker.trainer.train(
             self.reranker,
             train_dataset,
@@ -91,37 +220,32 @@ class RerankTask(Task):
             dev_dataset,
             dev_output_path,
             dev_qrels,
-            self.config["optimize"],
-            self.benchmark.relevance_level,
+            optimize,
+            relevance_level,
         )
 
         self.reranker.trainer.load_best_model(self.reranker, train_output_path)
         dev_output_path = train_output_path / "pred" / "dev" / "best"
-        if not dev_output_path.exists():
-            dev_preds = self.reranker.trainer.predict(self.reranker, dev_dataset, dev_output_path)
-
-        test_run = defaultdict(dict)
-        # This is possible because best_search_run is an OrderedDict
-        for qid, docs in best_search_run.items():
-            if qid in self.benchmark.folds[fold]["predict"]["test"]:
-                for idx, (docid, score) in enumerate(docs.items()):
-                    if idx >= self.config["testthreshold"]:
-                        break
-                    test_run[qid][docid] = score
+        # the trainer returns the dev predictions of the best weights when it saved them during this call;
+        # otherwise, reuse the predictions saved alongside those weights by an earlier call or predict them again
+        if not dev_preds:
+            if dev_output_path.exists():
+                dev_preds = Searcher.load_trec_run(dev_output_path)
+            else:
+                dev_preds = self.reranker.trainer.predict(self.reranker, dev_dataset, dev_output_path)
+
+        test_run = self._top_k_run(best_search_run, fold_info["predict"]["test"], testthreshold)
 
         test_dataset = PredSampler()
-        test_dataset.prepare(
-            test_run, self.benchmark.qrels, self.reranker.extractor, relevance_level=self.benchmark.relevance_level
-        )
+        test_dataset.prepare(test_run, qrels, extractor, relevance_level=relevance_level)
         test_output_path = train_output_path / "pred" / "test" / "best"
         test_preds = self.reranker.trainer.predict(self.reranker, test_dataset, test_output_path)
 
         preds = {"dev": dev_preds, "test": test_preds}
 
         if include_train:
-            train_dataset = PredSampler(
-                train_run, self.benchmark.qrels, self.reranker.extractor, relevance_level=self.benchmark.relevance_level
-            )
+            train_dataset = PredSampler()
+            train_dataset.prepare(train_run, qrels, extractor, relevance_level=relevance_level)
 
             train_output_path = train_output_path / "pred" / "train" / "best"
             train_preds = self.reranker.trainer.predict(self.reranker, train_dataset, train_output_path)
@@ -129,34 +253,35 @@ class RerankTask(Task):
 
         return preds
 
+    @staticmethod
+    def _top_k_run(run, qids, k):
+        """Returns a run containing the top k docs of each qid in qids that appears in the run"""
+        # This is possible because the run is an OrderedDict
+        return {qid: dict(itertools.islice(run[qid].items(), k)) for qid in qids if qid in run}
+
     def predict(self):
         fold = self.config["fold"]
+        testthreshold = self.config["testthreshold"]
+        fold_info = self.benchmark.folds[fold]
+        topics = self.benchmark.topics[self.benchmark.query_type]
+        qrels, relevance_level = self.benchmark.qrels, self.benchmark.relevance_level
+        extractor = self.reranker.extractor
+
         self.rank.search()
-        rank_results = self.rank.evaluate()
+        rank_results = self._get_rank_results()
         best_search_run_path = rank_results["path"][fold]
-        best_search_run = Searcher.load_trec_run(best_search_run_path)
+        best_search_run = load_trec_run_cached(best_search_run_path, self.run_cache)
 
-        docids = set(docid for querydocs in best_search_run.values() for docid in querydocs)
-        self.reranker.extractor.preprocess(
-            qids=best_search_run.keys(), docids=docids, topics=self.benchmark.topics[self.benchmark.query_type]
-        )
+        docids = set().union(*best_search_run.values())
+        extractor.preprocess(qids=best_search_run.keys(), docids=docids, topics=topics)
         train_output_path = self.get_results_path()
         self.reranker.build_model()
         self.reranker.trainer.load_best_model(self.reranker, train_output_path)
 
-        test_run = defaultdict(dict)
-        # This is possible because best_search_run is an OrderedDict
-        for qid, docs in best_search_run.items():
-            if qid in self.benchmark.folds[fold]["predict"]["test"]:
-                for idx, (docid, score) in enumerate(docs.items()):
-                    if idx >= self.config["testthreshold"]:
-                        break
-                    test_run[qid][docid] = score
+        test_run = self._top_k_run(best_search_run, fold_info["predict"]["test"], testthreshold)
 
         test_dataset = PredSampler()
-        test_dataset.prepare(
-            test_run, self.benchmark.qrels, self.reranker.extractor, relevance_level=self.benchmark.relevance_level
-        )
+        test_dataset.prepare(test_run, qrels, extractor, relevance_level=relevance_level)
         test_output_path = train_output_path / "pred" / "test" / "best"
         test_preds = self.reranker.trainer.predict(self.reranker, test_dataset, test_output_path)
 
@@ -180,26 +305,32 @@ class RerankTask(Task):
         logger.debug("results path: %s", train_output_path)
         metrics = self.config["metrics"] if list(self.config["metrics"]) != ["default"] else evaluator.DEFAULT_METRICS
 
-        searcher_runs, reranker_runs = self.find_crossvalidated_results()
-
-        if fold not in reranker_runs:
+        reranker_paths = self._find_reranker_paths()
+        if fold not in reranker_paths:
             logger.error("could not find predictions; run the train command first")
             raise ValueError("could not find predictions; run the train command first")
 
-        dev_qrels = {qid: self.benchmark.qrels.get(qid, {}) for qid in self.benchmark.folds[fold]["predict"]["dev"]}
-        fold_dev_metrics = evaluator.eval_runs(reranker_runs[fold]["dev"], dev_qrels, metrics, self.benchmark.relevance_level)
+        # only the current fold's runs are needed unless every fold has results, so load the others lazily below
+        fold_dev_run, fold_test_run = load_trec_runs_concurrently(
+            [reranker_paths[fold]["dev"], reranker_paths[fold]["test"]], self.run_cache
+        )
+
+        qrels = self.benchmark.qrels
+        fold_info = self.benchmark.folds[fold]
+        dev_qrels = {qid: qrels.get(qid, {}) for qid in fold_info["predict"]["dev"]}
+        fold_dev_metrics = evaluator.eval_runs(fold_dev_run, dev_qrels, metrics, self.benchmark.relevance_level)
         pretty_fold_dev_metrics = " ".join([f"{metric}={v:0.3f}" for metric, v in sorted(fold_dev_metrics.items())])
         logger.info("rerank: fold=%s dev metrics: %s", fold, pretty_fold_dev_metrics)
 
-        test_qrels = {qid: self.benchmark.qrels.get(qid, {}) for qid in self.benchmark.folds[fold]["predict"]["test"]}
-        fold_test_metrics = evaluator.eval_runs(reranker_runs[fold]["test"], test_qrels, metrics, self.benchmark.relevance_level)
+        test_qrels = {qid: qrels.get(qid, {}) for qid in fold_info["predict"]["test"]}
+        fold_test_metrics = evaluator.eval_runs(fold_test_run, test_qrels, metrics, self.benchmark.relevance_level)
         pretty_fold_test_metrics = " ".join([f"{metric}={v:0.3f}" for metric, v in sorted(fold_test_metrics.items())])
         logger.info("rerank: fold=%s test metrics: %s", fold, pretty_fold_test_metrics)
 
-        if len(reranker_runs) != len(self.benchmark.folds):
+        if len(reranker_paths) != len(self.benchmark.folds):
             logger.info(
                 "rerank: skipping cross-validated metrics because results exist for only %s/%s folds",
-                len(reranker_runs),
+                len(reranker_paths),
                 len(self.benchmark.folds),
             )
             return {
@@ -209,13 +340,14 @@ class RerankTask(Task):
                 "interpolated_cv_metrics": None,
             }
 
+        # the current fold's runs are served from the loader's cache rather than parsed again
+        searcher_runs, reranker_runs = self.find_crossvalidated_results()
+
         logger.info("rerank: average cross-validated metrics when choosing iteration based on '%s':", self.config["optimize"])
         all_preds = {}
         for preds in reranker_runs.values():
             for qid, docscores in preds["test"].items():
-                all_preds.setdefault(qid, {})
-                for docid, score in docscores.items():
-                    all_preds[qid][docid] = score
+                all_preds.setdefault(qid, {}).update(docscores)
 
         cv_metrics = evaluator.eval_runs(all_preds, self.benchmark.qrels, metrics, self.benchmark.relevance_level)
         interpolated_results = evaluator.interpolated_eval(
@@ -236,39 +368,46 @@ class RerankTask(Task):
             "interpolated_results": interpolated_results,
         }
 
+    def _find_reranker_paths(self):
+        """Returns {fold: {"test": path, "dev": path}} for each fold whose test predictions exist, without loading them"""
+        train_output_path = self.get_results_path()
+        # TODO fix by using multiple Tasks
+        test_paths = find_existing_fold_paths(
+            train_output_path / "pred" / "test" / "best", self.config["fold"], self.benchmark.folds
+        )
+        dev_path_for_fold = fold_path_formatter(train_output_path / "pred" / "dev" / "best", self.config["fold"])
+        return {fold: {"test": test_path, "dev": dev_path_for_fold(fold)} for fold, test_path in test_paths.items()}
+
     def find_crossvalidated_results(self):
-        searcher_runs = {}
-        rank_results = self.rank.evaluate()
-        for fold in self.benchmark.folds:
-            searcher_runs[fold] = {"dev": Searcher.load_trec_run(rank_results["path"][fold])}
-            searcher_runs[fold]["test"] = searcher_runs[fold]["dev"]
+        rank_results = self._get_rank_results()
+        searcher_paths = {fold: rank_results["path"][fold] for fold in self.benchmark.folds}
 
-        reranker_runs = {}
-        train_output_path = self.get_results_path()
-        test_output_path = train_output_path / "pred" / "test" / "best"
-        dev_output_path = train_output_path / "pred" / "dev" / "best"
-        for fold in self.benchmark.folds:
-            # TODO fix by using multiple Tasks
-            test_path = Path(test_output_path.as_posix().replace("fold-" + self.config["fold"], "fold-" + fold))
-            if os.path.exists(test_path):
-                reranker_runs.setdefault(fold, {})["test"] = Searcher.load_trec_run(test_path)
+        reranker_paths = [
+            (fold, split, path)
+            for fold, split_paths in self._find_reranker_paths().items()
+            for split, path in split_paths.items()
+        ]
 
-                dev_path = Path(dev_output_path.as_posix().replace("fold-" + self.config["fold"], "fold-" + fold))
-                reranker_runs.setdefault(fold, {})["dev"] = Searcher.load_trec_run(dev_path)
+        runs = load_trec_runs_concurrently(
+            list(searcher_paths.values()) + [path for _, _, path in reranker_paths], self.run_cache
+        )
+        searcher_runs = {fold: {"dev": run, "test": run} for fold, run in zip(searcher_paths, runs)}
+        reranker_runs = {}
+        for (fold, split, _), run in zip(reranker_paths, runs[len(searcher_paths) :]):
+            reranker_runs.setdefault(fold, {})[split] = run
 
         return searcher_runs, reranker_runs
 
     def find_birch_crossvalidated_results(self):
         searcher_runs = {}
-        rank_results = self.rank.evaluate()
-        reranker_runs = {}
+        rank_results = self._get_rank_results()
         train_output_path = self.get_results_path()
-        test_output_path = train_output_path / "pred" / "test" / "best"
-        dev_output_path = train_output_path / "pred" / "dev" / "best"
-        for fold in self.benchmark.folds:
-            # TODO fix by using multiple Tasks
-            test_path = Path(test_output_path.as_posix().replace("fold-" + self.config["fold"], "fold-" + fold))
-            if os.path.exists(test_path):
-                reranker_runs.setdefault(fold, {})["test"] = Searcher.load_trec_run(test_path)
+        # TODO fix by using multiple Tasks
+        test_paths = find_existing_fold_paths(
+            train_output_path / "pred" / "test" / "best", self.config["fold"], self.benchmark.folds
+        )
+
+        runs = load_trec_runs_concurrently(list(test_paths.values()), self.run_cache)
+        reranker_runs = {fold: {"test": run} for fold, run in zip(test_paths, runs)}
 
         return searcher_runs, reranker_runs
@@ -1,7 +1,12 @@
+from pathlib import Path
+
 import pytest
 
-from capreolus import Benchmark, Task, module_registry
+from capreolus import Benchmark, Searcher, Task, module_registry
+from capreolus.task import rerank
+from capreolus.task.rerank import find_existing_fold_paths
 from capreolus.tests.common_fixtures import dummy_index, tmpdir_as_cache
+from capreolus.utils.common import OrderedDefaultDict
 
 tasks = set(module_registry.get_module_names("task"))
 
@@ -10,3 +15,62 @@ tasks = set(module_registry.get_module_names("task"))
 def test_task_creatable(tmpdir_as_cache, dummy_index, task_name):
     provide = {"index": dummy_index, "benchmark": Benchmark.create("dummy"), "collection": dummy_index.collection}
     task = Task.create(task_name, provide=provide)
+
+
+def test_find_existing_fold_paths(tmpdir):
+    for fold in ["s1", "s3"]:
+        pred_dir = tmpdir / f"task-rerank_fold-{fold}_optimize-map" / "pred" / "test"
+        pred_dir.ensure(dir=True)
+        if fold == "s1":
+            (pred_dir / "best").write("")
+    (tmpdir / "unrelated").ensure(dir=True)
+
+    path = tmpdir / "task-rerank_fold-s1_optimize-map" / "pred" / "test" / "best"
+    found = find_existing_fold_paths(path, "s1", ["s1", "s2", "s3"])
+    assert list(found) == ["s1"]
+    assert found["s1"] == Path(path)
+
+    found = find_existing_fold_paths(tmpdir / "missing" / "task-rerank_fold-s1" / "best", "s1", ["s1", "s2"])
+    assert found == {}
+
+
+def test_traineval_all_folds_serial(monkeypatch, tmpdir_as_cache, dummy_index):
+    provide = {"index": dummy_index, "benchmark": Benchmark.create("dummy"), "collection": dummy_index.collection}
+    task = Task.create("rerank", provide=provide)
+
+    trained = []
+
+    class TrainedTask:
+        def __init__(self, module_name, config):
+            self.module_name, self.config = module_name, config
+
+        def train(self):
+            trained.append((self.module_name, self.config["fold"]))
+
+    monkeypatch.setattr(rerank.torch.cuda, "device_count", lambda: 0)
+    monkeypatch.setattr(rerank.Task, "create", lambda module_name, config=None, provide=None: TrainedTask(module_name, config))
+    monkeypatch.setattr(task.rank, "search", lambda: None)
+    monkeypatch.setattr(task, "evaluate", lambda: "metrics")
+
+    def preprocess(*args, **kwargs):
+        raise AssertionError("the extractor should be preprocessed by each fold's task rather than up front")
+
+    monkeypatch.setattr(task.reranker.extractor, "preprocess", preprocess)
+
+    assert task.traineval_all_folds() == "metrics"
+    assert trained == [("rerank", fold) for fold in task.benchmark.folds]
+
+
+def test_load_trec_run_cached(tmpdir):
+    fn = tmpdir / "run.txt"
+    fn.write("301 Q0 d1 1 2.0 capreolus\n301 Q0 d2 2 1.0 capreolus\n")
+
+    cache = {}
+    run = rerank.load_trec_run_cached(fn, cache)
+    assert run == Searcher.load_trec_run(fn)
+    assert isinstance(run, OrderedDefaultDict)
+    assert rerank.load_trec_run_cached(fn, cache) is run
+
+    fn.write("302 Q0 d3 1 3.0 capreolus\n")
+    assert rerank.load_trec_run_cached(fn, cache) == {"302": {"d3": 3.0}}
+    assert len(cache) == 1
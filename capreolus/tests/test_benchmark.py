@@ -1,3 +1,4 @@
+import gzip
 import os
 import pickle
 from collections import defaultdict
@@ -11,6 +12,7 @@ from capreolus.utils.trec import load_qrels
 
 from capreolus.benchmark.codesearchnet import CodeSearchNetChallenge as CodeSearchNetCodeSearchNetChallengeBenchmark
 from capreolus.benchmark.codesearchnet import CodeSearchNetCorpus as CodeSearchNetCodeSearchNetCorpusBenchmark
+from capreolus.benchmark.codesearchnet import open_gz
 from capreolus.collection.codesearchnet import CodeSearchNet as CodeSearchNetCollection
 from capreolus.collection.covid import COVID as CovidCollection
 from capreolus.benchmark.covid import COVID as CovidBenchmark
@@ -48,6 +50,16 @@ def test_csn_corpus_benchmark_downloadifmissing():
         assert os.path.exists(benchmark.fold_dir / f"{lang}.json")
 
 
+def test_csn_open_gz(tmpdir):
+    fn = os.path.join(tmpdir, "docs.jsonl.gz")
+    lines = [b'{"url": "a"}\n', b'{"url": "b"}\n']
+    with gzip.open(fn, "wb") as f:
+        f.writelines(lines)
+
+    with open_gz(fn) as f:
+        assert list(f) == lines
+
+
 def _load_trec_doc(fn):
     id2doc = {}
     with open(fn, "r", encoding="utf-8") as f:
@@ -8,3 +8,21 @@ def test_interpolate_runs():
     qids = run1.keys()
     assert evaluator.interpolate_runs(run1, run2, qids, 0.5) == {1: {"d1": 0.5, "d2": 0.5}, 2: {"d1": 0.0, "d2": 1.0}}
     assert evaluator.interpolate_runs(run1, run2, qids, 0.2) == {1: {"d1": 0.8, "d2": 0.2}, 2: {"d1": 0.0, "d2": 1.0}}
+
+    # a qid without first-stage results is missing from both runs
+    assert evaluator.interpolate_runs(run1, run2, [1, 3], 0.5) == {1: {"d1": 0.5, "d2": 0.5}, 3: {}}
+    assert 3 not in run1 and 3 not in run2
+
+
+def test_eval_runs_reuses_relevance_evaluator():
+    qrels = {"q1": {"d1": 1, "d2": 0}, "q2": {"d1": 0, "d2": 1}}
+    run1 = {"q1": {"d1": 2.0, "d2": 1.0}, "q2": {"d1": 2.0, "d2": 1.0}}
+    run2 = {"q1": {"d1": 1.0, "d2": 2.0}, "q2": {"d1": 1.0, "d2": 2.0}}
+
+    assert evaluator.eval_runs(run1, qrels, ["P_1", "map"]) == {"P_1": 0.5, "map": 0.75}
+    cached = evaluator._get_relevance_evaluator(qrels, ["P_1", "map"], 1)
+    assert evaluator.eval_runs(run2, qrels, ["P_1", "map"]) == {"P_1": 0.5, "map": 0.75}
+    assert evaluator._get_relevance_evaluator(qrels, ["P_1", "map"], 1) is cached
+
+    # an equal but distinct qrels object is not served from the cache
+    assert evaluator._get_relevance_evaluator(dict(qrels), ["P_1", "map"], 1) is not cached
@@ -392,6 +392,51 @@ def test_bagofwords_id2vec_trigram(tmpdir, dummy_index):
     assert np.array_equal(transformed["posdoc"], [32, 3, 3, 3, 3, 3, 1])
 
 
+def test_bagofwords_id2vec_docvec_cache(tmpdir, dummy_index):
+    benchmark = DummyBenchmark({})
+    tok_cfg = {"name": "anserini", "keepstops": True, "stemmer": "none"}
+    tokenizer = AnseriniTokenizer(tok_cfg)
+    extractor = BagOfWords(
+        {"name": "bagofwords", "datamode": "unigram", "maxqlen": 4, "maxdoclen": 800, "usecache": False},
+        provide={"index": dummy_index, "tokenizer": tokenizer, "benchmark": benchmark},
+    )
+    extractor.stoi = {extractor.pad_tok: extractor.pad, "dummy": 1}
+    extractor.itos = {extractor.pad: extractor.pad_tok, 1: "dummy"}
+    extractor.idf = defaultdict(lambda: 0)
+    extractor.qid2toks = {"301": ["dummy"]}
+    extractor.docid2toks = {"LA010189-0001": ["dummy", "dummy", "hello"]}
+
+    assert np.array_equal(extractor.id2vec("301", "LA010189-0001")["posdoc"], [1, 2])
+    nonzero_ids, counts = extractor._docvec_cache["LA010189-0001"]
+    assert np.array_equal(nonzero_ids, [0, 1])
+    assert np.array_equal(counts, [1, 2])
+    assert np.array_equal(extractor.id2vec("301", "LA010189-0001")["posdoc"], [1, 2])
+
+    # growing the vocabulary invalidates the cached doc vectors
+    extractor.stoi["hello"] = 2
+    extractor.itos[2] = "hello"
+    assert np.array_equal(extractor.id2vec("301", "LA010189-0001")["posdoc"], [0, 2, 1])
+
+
+def test_bagofwords_id2vec_query_idf(tmpdir, dummy_index):
+    benchmark = DummyBenchmark({})
+    tok_cfg = {"name": "anserini", "keepstops": True, "stemmer": "none"}
+    tokenizer = AnseriniTokenizer(tok_cfg)
+    extractor = BagOfWords(
+        {"name": "bagofwords", "datamode": "unigram", "maxqlen": 4, "maxdoclen": 800, "usecache": False},
+        provide={"index": dummy_index, "tokenizer": tokenizer, "benchmark": benchmark},
+    )
+    extractor.stoi = {extractor.pad_tok: extractor.pad, "dummy": 1, "doc": 2}
+    extractor.itos = {v: k for k, v in extractor.stoi.items()}
+    extractor.idf = defaultdict(lambda: 0, {"dummy": 0.5, "doc": 2.0})
+    extractor.qid2toks = {"301": ["doc", "unknown"]}
+    extractor.docid2toks = {"LA010189-0001": ["dummy", "doc"]}
+
+    transformed = extractor.id2vec("301", "LA010189-0001")
+    assert np.array_equal(extractor.idf_array, [0, 0.5, 2.0])
+    assert np.array_equal(transformed["query_idf"], [0, 0, 2.0])
+
+
 def test_bagofwords_caching(dummy_index, monkeypatch):
     def fake_magnitude_embedding(*args, **kwargs):
         return Magnitude(None)
@@ -766,6 +811,31 @@ def test_bertpassage_id2vec(monkeypatch):
     ]
 
 
+def test_bertpassage_maxdocchars(monkeypatch):
+    benchmark = DummyBenchmark()
+    extractor = BertPassage(
+        {
+            "numpassages": 2,
+            "passagelen": 3,
+            "maxseqlen": 20,
+            "stride": 3,
+            "maxdocchars": 12,
+            "index": {"collection": {"name": "dummy"}},
+        },
+        provide=benchmark,
+    )
+
+    def get_doc(*args, **kwargs):
+        return "O that we now had here but one ten thousand of those men in"
+
+    monkeypatch.setattr(AnseriniIndex, "get_doc", get_doc)
+
+    # only "O that we no" is tokenized, so the second passage ends at the truncated word rather than continuing
+    passages = extractor._get_passages("some_docid")
+    assert passages[0] == extractor.tokenizer.tokenize("O that we")
+    assert passages[1] == extractor.tokenizer.tokenize("no")
+
+
 def test_bertpassage_id2vec_with_pad(monkeypatch):
     benchmark = DummyBenchmark()
     extractor = BertPassage(
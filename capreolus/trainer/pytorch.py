@@ -1,4 +1,5 @@
 import contextlib
+import itertools
 import math
 import os
 import time
@@ -15,6 +16,59 @@ from . import Trainer
 
 logger = get_logger(__name__)  # pylint: disable=invalid-name
 RESULTS_BASE_PATH = constants["RESULTS_BASE_PATH"]
+# inference_mode skips more autograd bookkeeping than no_grad, but requires PyTorch >= 1.9
+inference_mode = getattr(torch, "inference_mode", torch.no_grad)
+
+
+def batch_to_device(batch, device, non_blocking=False):
+    return {k: v.to(device, non_blocking=non_blocking) if not isinstance(v, list) else v for k, v in batch.items()}
+
+
+class CUDAPrefetcher:
+    """Iterates over batches from a DataLoader, moving each batch to device.
+    On a CUDA device, the copy of the next batch is issued on a side stream before the current batch is yielded,
+    so that it overlaps with the work done on the current batch. Elsewhere, batches are moved synchronously.
+
+    Args:
+       batches (iterable): batches (dicts) to iterate over, e.g. a DataLoader created with pin_memory=True
+       device (torch.device): device to move batches to
+       limit (int): maximum number of batches to yield (or None for no limit); no batch is read beyond this limit
+    """
+
+    def __init__(self, batches, device, limit=None):
+        self.batches = batches
+        self.device = device
+        self.limit = limit
+
+    def __iter__(self):
+        batches = iter(self.batches) if self.limit is None else itertools.islice(self.batches, self.limit)
+        if self.device.type != "cuda":
+            for batch in batches:
+                yield batch_to_device(batch, self.device)
+            return
+
+        stream = torch.cuda.Stream(device=self.device)
+
+        def preload():
+            batch = next(batches, None)
+            if batch is None:
+                return None
+
+            with torch.cuda.stream(stream):
+                return batch_to_device(batch, self.device, non_blocking=True)
+
+        next_batch = preload()
+        while next_batch is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(stream)
+            batch = next_batch
+            # the tensors were allocated on the side stream but are used on the current one
+            for v in batch.values():
+                if torch.is_tensor(v):
+                    v.record_stream(current_stream)
+
+            next_batch = preload()
+            yield batch
 
 
 @Trainer.register
@@ -41,8 +95,12 @@ class PytorchTrainer(Trainer):
         ConfigOption("decayiters", 3),
         ConfigOption("decaytype", None),
         ConfigOption("amp", None, "Automatic mixed precision mode; one of: None, train, pred, both"),
+        ConfigOption(
+            "jit", False, "compile the model's forward for prediction with torch.compile (or torch.jit.script before PyTorch 2)"
+        ),
+        ConfigOption("prefetch", True, "copy the next batch to the GPU while the current batch is being processed"),
     ]
-    config_keys_not_in_path = ["boardname"]
+    config_keys_not_in_path = ["boardname", "jit", "prefetch"]
 
     def build(self):
         # sanity checks
@@ -89,9 +147,13 @@ class PytorchTrainer(Trainer):
         batches_since_update = 0
         batches_per_step = self.config["gradacc"]
 
-        for bi, batch in tqdm(enumerate(train_dataloader), desc="Training iteration", total=self.n_batch_per_iter):
-            batch = {k: v.to(self.device) if not isinstance(v, list) else v for k, v in batch.items()}
+        if self.config["prefetch"]:
+            # limit the prefetcher to this iteration's batches so that it does not read ahead into the next iteration
+            batches = CUDAPrefetcher(train_dataloader, self.device, limit=self.n_batch_per_iter)
+        else:
+            batches = (batch_to_device(batch, self.device) for batch in train_dataloader)
 
+        for bi, batch in tqdm(enumerate(batches), desc="Training iteration", total=self.n_batch_per_iter):
             with self.amp_train_autocast():
                 doc_scores = reranker.score(batch)
                 loss = self.loss(doc_scores)
@@ -192,6 +254,10 @@ class PytorchTrainer(Trainer):
            dev_data (IterableDataset): dev dataset
            dev_output_path (Path): directory where dev_data runs and metrics will be saved
 
+        Returns:
+           TREC Run predicted on dev_data by the best weights found during this call (also written to dev_output_path / "best"),
+           or an empty dict if no new best weights were found (e.g., when resuming a finished run)
+
         """
         # Set up logging
         # TODO why not put this under train_output_path?
@@ -237,6 +303,7 @@ class PytorchTrainer(Trainer):
         logger.info("starting training from iteration %s/%s", initial_iter + 1, self.config["niters"])
         logger.info(f"Best metric loaded: {metric}={dev_best_metric}")
 
+        best_preds = {}
         train_loss = []
         # are we resuming training? fastforward loss and data if so
         if initial_iter > 0:
@@ -281,6 +348,8 @@ class PytorchTrainer(Trainer):
                     logger.info("new best dev metric: %0.4f", dev_best_metric)
                     reranker.save_weights(dev_best_weight_fn, self.optimizer)
                     self.write_to_metric_file(metric_fn, metrics)
+                    Searcher.write_trec_run(preds, dev_output_path / "best")
+                    best_preds = preds
 
             # write train_loss to file
             # loss_fn.write_text("\n".join(f"{idx} {loss}" for idx, loss in enumerate(train_loss)))
@@ -294,6 +363,7 @@ class PytorchTrainer(Trainer):
         summary_writer.close()
 
         # TODO should we write a /done so that training can be skipped if possible when fastforward=False? or in Task?
+        return best_preds
 
     def load_best_model(self, reranker, train_output_path):
         self.optimizer = torch.optim.Adam(
@@ -330,24 +400,70 @@ class PytorchTrainer(Trainer):
         evalbatch = self.config["evalbatch"] if self.config["evalbatch"] > 0 else self.config["batch"]
         num_workers = 1 if self.config["multithread"] else 0
         pred_dataloader = torch.utils.data.DataLoader(pred_data, batch_size=evalbatch, pin_memory=True, num_workers=num_workers)
-        with torch.autograd.no_grad():
-            for batch in tqdm(pred_dataloader, desc="Predicting", total=len(pred_data) // evalbatch):
-                if len(batch["qid"]) != evalbatch:
-                    batch = self.fill_incomplete_batch(batch, batch_size=evalbatch)
-
-                batch = {k: v.to(self.device) if not isinstance(v, list) else v for k, v in batch.items()}
-                with self.amp_pred_autocast():
-                    scores = reranker.test(batch)
-                scores = scores.view(-1).cpu().numpy()
-                for qid, docid, score in zip(batch["qid"], batch["posdocid"], scores):
-                    # Need to use float16 because pytrec_eval's c function call crashes with higher precision floats
-                    preds.setdefault(qid, {})[docid] = score.astype(np.float16).item()
+        # the reranker calls its model from test(), so swap in the compiled model only while predicting;
+        # the original module is restored afterward so that training and saved weights are unaffected
+        reranker.model = self.get_pred_model(model)
+        try:
+            with inference_mode():
+                batches = (
+                    batch if len(batch["qid"]) == evalbatch else self.fill_incomplete_batch(batch, batch_size=evalbatch)
+                    for batch in pred_dataloader
+                )
+                if self.config["prefetch"]:
+                    batches = CUDAPrefetcher(batches, self.device)
+                else:
+                    batches = (batch_to_device(batch, self.device) for batch in batches)
+
+                for batch in tqdm(batches, desc="Predicting", total=len(pred_data) // evalbatch):
+                    try:
+                        with self.amp_pred_autocast():
+                            scores = reranker.test(batch)
+                    except Exception as e:
+                        # torch.compile compiles on the first call, so compilation errors only surface here
+                        if reranker.model is model or preds:
+                            raise
+                        logger.warning(
+                            "could not run the compiled %s; predicting without compilation: %s", type(model).__name__, e
+                        )
+                        reranker.model = self._pred_model = model
+                        with self.amp_pred_autocast():
+                            scores = reranker.test(batch)
+                    scores = scores.view(-1).cpu().numpy()
+                    for qid, docid, score in zip(batch["qid"], batch["posdocid"], scores):
+                        # Need to use float16 because pytrec_eval's c function call crashes with higher precision floats
+                        preds.setdefault(qid, {})[docid] = score.astype(np.float16).item()
+        finally:
+            reranker.model = model
 
         os.makedirs(os.path.dirname(pred_fn), exist_ok=True)
         Searcher.write_trec_run(preds, pred_fn)
 
         return preds
 
+    def get_pred_model(self, model):
+        """Returns the model to use for prediction: model itself, or a compiled version of it when config["jit"] is set.
+        The compiled model shares model's parameters and is reused until a different model is passed.
+        Only forward is compiled, so models that predict with another method (test_forward) are returned uncompiled."""
+        if not self.config["jit"]:
+            return model
+
+        if hasattr(model, "test_forward"):
+            logger.warning("jit only compiles forward, but %s predicts with test_forward; not compiling it", type(model).__name__)
+            return model
+
+        if getattr(self, "_pred_model_source", None) is not model:
+            try:
+                if hasattr(torch, "compile"):
+                    self._pred_model = torch.compile(model, mode="reduce-overhead")
+                else:
+                    self._pred_model = torch.jit.script(model)
+            except Exception as e:
+                logger.warning("could not compile %s for prediction; using it without compilation: %s", type(model).__name__, e)
+                self._pred_model = model
+            self._pred_model_source = model
+
+        return self._pred_model
+
     def fill_incomplete_batch(self, batch, batch_size=None):
         """
         If a batch is incomplete (i.e shorter than the desired batch size), this method fills in the batch with some data.
@@ -85,8 +85,10 @@ class TensorflowTrainer(Trainer):
         ConfigOption("decayiters", 3),
         ConfigOption("decaytype", None),
         ConfigOption("amp", False, "use automatic mixed precision"),
+        ConfigOption("ampbf16", False, "use bfloat16 rather than float16 for mixed precision on GPUs (Ampere or newer)"),
+        ConfigOption("xla", False, "use XLA to JIT compile and fuse the model's ops"),
     ]
-    config_keys_not_in_path = ["fastforward", "boardname", "usecache", "tpuname", "tpuzone", "storage"]
+    config_keys_not_in_path = ["fastforward", "boardname", "usecache", "tpuname", "tpuzone", "storage", "xla"]
 
     def build(self):
         tf.random.set_seed(self.config["seed"])
@@ -121,10 +123,16 @@ class TensorflowTrainer(Trainer):
             self.strategy = tf.distribute.get_strategy()
 
         self.amp = self.config["amp"]
+        use_bf16 = self.tpu or self.config["ampbf16"]
+        # bfloat16 has the same exponent range as float32, so loss scaling is only needed with float16
+        self.loss_scaling = self.amp and not use_bf16
         if self.amp:
-            policy = mixed_precision.Policy("mixed_bfloat16" if self.tpu else "mixed_float16")
+            policy = mixed_precision.Policy("mixed_bfloat16" if use_bf16 else "mixed_float16")
             mixed_precision.set_policy(policy)
 
+        # the JIT setting is global to the process, so set it either way rather than leaving a previous trainer's setting
+        tf.config.optimizer.set_jit(bool(self.config["xla"]))
+
         # Defining some props that we will later initialize
         self.validate()
 
@@ -161,7 +169,7 @@ class TensorflowTrainer(Trainer):
             optimizer_2 = tf.keras.optimizers.Adam(learning_rate=self.config["bertlr"])
 
             # "You should remove the use of the LossScaleOptimizer when TPUs are used."
-            if self.amp and not self.tpu:
+            if self.loss_scaling:
                 optimizer_2 = mixed_precision.LossScaleOptimizer(optimizer_2, loss_scale="dynamic")
 
             def compute_loss(labels, predictions):
@@ -181,11 +189,11 @@ class TensorflowTrainer(Trainer):
             with tf.GradientTape() as tape:
                 train_predictions = wrapped_model(data, training=True)
                 loss = compute_loss(labels, train_predictions)
-                if self.amp and not self.tpu:
+                if self.loss_scaling:
                     loss = optimizer_2.get_scaled_loss(loss)
 
             gradients = tape.gradient(loss, wrapped_model.trainable_variables)
-            if self.amp and not self.tpu:
+            if self.loss_scaling:
                 optimizer_2.get_unscaled_gradients(gradients)
 
             bert_variables = [
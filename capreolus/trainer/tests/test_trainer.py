@@ -3,9 +3,11 @@ import os
 
 import numpy as np
 import tensorflow as tf
+import torch
 
 from capreolus.benchmark import DummyBenchmark
 from capreolus.sampler import TrainTripletSampler
+from capreolus.trainer.pytorch import CUDAPrefetcher
 from capreolus.trainer.tensorflow import TensorflowTrainer
 from capreolus.extractor.slowembedtext import SlowEmbedText
 from capreolus.reranker.TFKNRM import TFKNRM
@@ -103,3 +105,19 @@ def test_tf_find_cached_tf_records(monkeypatch, dummy_index):
     reranker.trainer.convert_to_tf_train_record(reranker, train_dataset)
     assert reranker.trainer.find_cached_tf_records(train_dataset, 24) is not None
     assert reranker.trainer.find_cached_tf_records(train_dataset, 18) is not None
+
+
+def test_cuda_prefetcher_limit():
+    batches = [{"qid": [str(i)], "query": torch.tensor([i])} for i in range(5)]
+    consumed = []
+
+    def generate():
+        for batch in batches:
+            consumed.append(batch["qid"][0])
+            yield batch
+
+    prefetched = list(CUDAPrefetcher(generate(), torch.device("cpu"), limit=3))
+    assert [batch["qid"] for batch in prefetched] == [["0"], ["1"], ["2"]]
+    assert [batch["query"].item() for batch in prefetched] == [0, 1, 2]
+    # batches beyond the limit are never read from the underlying iterator
+    assert consumed == ["0", "1", "2"]